@@ -4,15 +4,16 @@ DNA Fragment Grouper – GUI wrapper
 
 from __future__ import annotations
 import os
+import re
 import threading
 import warnings
 from pathlib import Path
-from typing import Callable, List, Set
+from typing import Callable, Dict, List, Set, Tuple
 
 import numpy as np
 import pandas as pd
-import random
-import distance
+from rapidfuzz.distance import Levenshtein
+from rapidfuzz.process import cdist
 from sklearn.cluster import AffinityPropagation
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
@@ -23,22 +24,79 @@ BsaI       = "GGTCTC";  BsaI_rev   = "GAGACC"
 BbsI       = "GAAGACT"; BbsI_rev   = "AGTCTTC"
 BspMI      = "ACCTGCTTA"; BspMI_rev = "TAAGCAGGT"
 
+CUT_SITES  = (
+    BsmBI, BsaI, BbsI, BspMI,
+    BsmBI_rev, BsaI_rev, BbsI_rev, BspMI_rev,
+)
+# all cut sites in one compiled pattern, matched in a single pass per scan
+CUT_SITE_RE = re.compile("|".join(CUT_SITES))
+# BsmBI sites, applied in order: the 2nd becomes BbsI, then the 2nd of those
+# left (originally the 3rd) becomes BspMI
+BsmBI_SWAPS = (
+    (BsmBI, BbsI, 2), (BsmBI_rev, BbsI_rev, 2),
+    (BsmBI, BspMI, 2), (BsmBI_rev, BspMI_rev, 2),
+)
+# lookahead, so overlapping BsmBI sites are all found
+BsmBI_SWAP_RE = re.compile("(?=(%s|%s))" % (BsmBI, BsmBI_rev))
+
 NUCL       = ["A", "T", "C", "G"]
 MIN_LENGTH = 301
 MAX_LENGTH = 499
 
 # ----------------------------------------------------------------------
 
-def nth_repl(s: str, old: str, new: str, n: int) -> str:
-    """Replace the n‑th occurrence of *old* in *s* by *new*."""
-    find = s.find(old)
-    i = int(find != -1)
-    while find != -1 and i != n:
-        find = s.find(old, find + 1)
-        i += 1
-    if i == n and i <= len(s.split(old)) - 1:
-        return s[:find] + new + s[find + len(old) :]
-    return s
+def _count_non_overlapping(starts: List[int], length: int) -> int:
+    """Count the occurrences of a site that ``str.count`` would see, given all starts."""
+    count = 0
+    end = -1
+    for start in starts:
+        if start >= end:
+            count += 1
+            end = start + length
+    return count
+
+
+def replace_nth_multi(
+    s: str, rules: Tuple[Tuple[str, str, int], ...], pattern: re.Pattern
+) -> str:
+    """Apply ``(old, new, n)`` *rules* in order, each replacing the n‑th *old*.
+
+    Equivalent to one find‑and‑replace pass per rule: overlapping occurrences
+    are counted, a rule only fires if *old* occurs at least n times without
+    overlap, and occurrences overlapping a replaced site are gone for later
+    rules. *s* is scanned once with *pattern*, a lookahead alternation of the
+    *old* sites, so sites a replacement would newly create at its edges are
+    not seen.
+    """
+    # a rule looks at its first n live hits plus one for the count check, and
+    # each replacement removes at most three overlapping hits per site
+    cap = sum(n + 4 for _, _, n in rules)
+    hits: Dict[str, List[int]] = {old: [] for old, _, _ in rules}
+    for match in pattern.finditer(s):
+        starts = hits[match.group(1)]
+        if len(starts) < cap:
+            starts.append(match.start())
+        elif all(len(other) >= cap for other in hits.values()):
+            break  # later hits cannot change the result
+
+    edits: List[Tuple[int, int, str]] = []
+    for old, new, n in rules:
+        starts = hits[old]
+        if len(starts) < n or _count_non_overlapping(starts, len(old)) < n:
+            continue
+        start, end = starts[n - 1], starts[n - 1] + len(old)
+        edits.append((start, end, new))
+        for site, site_starts in hits.items():
+            hits[site] = [p for p in site_starts if p + len(site) <= start or p >= end]
+
+    parts: List[str] = []
+    last = 0
+    for start, end, new in sorted(edits):
+        parts.append(s[last:start])
+        parts.append(new)
+        last = end
+    parts.append(s[last:])
+    return "".join(parts)
 
 # ----------------------------------------------------------------------
 # Pipeline functions
@@ -48,15 +106,34 @@ def compute_distance_matrix(
     progress: Callable[[float], None] | None = None,
 ) -> np.ndarray:
     """Compute Levenshtein similarity matrix, emitting ≤100 progress updates."""
+    if progress is None:
+        # nothing to report: one native call, which only fills one triangle
+        # itself when queries and choices are the same object
+        dist = cdist(
+            fragments, fragments, scorer=Levenshtein.distance, dtype=np.int32, workers=-1
+        )
+        matrix = dist.astype(float)
+        np.negative(matrix, out=matrix)
+        return matrix
+
     n = len(fragments)
     matrix = np.empty((n, n), dtype=float)
     step = max(1, n // 100)
-    for i, f2 in enumerate(fragments):
-        if i % step == 0 and progress:
-            progress((i / n) * 80 + 2)
-        matrix[i] = [-distance.levenshtein(f1, f2) for f1 in fragments]
-    if progress:
-        progress(90)
+    # fill the matrix in row chunks so progress can be reported between C calls;
+    # the distance is symmetric, so only the upper triangle is computed and mirrored
+    for i0 in range(0, n, step):
+        progress((1 - ((n - i0) / n) ** 2) * 80 + 2)
+        i1 = min(i0 + step, n)
+        block = -cdist(
+            fragments[i0:i1],
+            fragments[i0:],
+            scorer=Levenshtein.distance,
+            dtype=np.int32,
+            workers=-1,
+        )
+        matrix[i0:i1, i0:] = block
+        matrix[i0:, i0:i1] = block.T
+    progress(90)
     return matrix
 
 
@@ -67,40 +144,50 @@ def group_fragments(
     progress: Callable[[float], None] | None = None,
 ) -> pd.DataFrame:
     fragments = df["Sequence"].tolist()
-    used_fragments: Set[str] = set()
+    cluster_ids = df["Cluster"].tolist()
+    frag_lengths = df["Sequence"].str.len().tolist()
+    used = np.zeros(len(fragments), dtype=bool)
+    n_used = 0
     group_labels = np.empty(len(fragments))
     group_counter = 0
     iter_counter = 0
+    reported = 90.0
 
-    while len(used_fragments) < len(fragments):
+    while n_used < len(fragments):
         group: List[str] = []
         total_length = 0
         clusters: Set[int] = set()
 
-        for idx, row in df.iterrows():
-            frag = row["Sequence"]
-            cluster = row["Cluster"]
-            if frag in used_fragments:
+        for idx, (frag, cluster, frag_length) in enumerate(
+            zip(fragments, cluster_ids, frag_lengths)
+        ):
+            if used[idx]:
                 continue
-            frag_length = len(frag)
             if (
                 len(group) < 3 and total_length + frag_length <= max_length and cluster not in clusters
             ):
                 group.append(frag)
                 clusters.add(cluster)
                 total_length += frag_length
-                used_fragments.add(frag)
+                used[idx] = True
+                n_used += 1
                 group_labels[idx] = group_counter
             elif len(group) == 0 and frag_length >= 500:
                 group_labels[idx] = group_counter
                 group_counter += 1
-                used_fragments.add(frag)
+                used[idx] = True
+                n_used += 1
         group_counter += 1
         iter_counter += 1
-        if progress:
-            progress(90 + (len(used_fragments) / len(fragments)) * 5)  # 90–95 %
+        percent = 90 + (n_used / len(fragments)) * 5  # 90–95 %
+        # at most ~100 updates, each one is marshalled onto the Tk main loop
+        if progress and percent - reported >= 0.05:
+            progress(percent)
+            reported = percent
         if iter_counter > len(fragments) * 3:
             break
+    if progress and reported < 95:
+        progress(95)  # the throttle may have skipped the last sweep
     out = df.copy()
     out["Group"] = group_labels.astype(int)
     return out
@@ -108,33 +195,60 @@ def group_fragments(
 
 def apply_aggressive_grouping(df1: pd.DataFrame) -> pd.DataFrame:
     df = df1.copy()
-    singleton_groups = [g for g, sub in df.groupby("Group") if len(sub) == 1]
-    for i, gid in enumerate(singleton_groups):
-        if i % 3 == 0:
-            new = gid
-        else:
-            df.loc[df["Group"] == gid, "Group"] = new
+    counts = df["Group"].value_counts()
+    singleton_groups = np.sort(counts.index[counts == 1].to_numpy())
+    # every third singleton keeps its id, the following two are merged into it
+    targets = singleton_groups[np.arange(len(singleton_groups)) // 3 * 3]
+    remap = dict(zip(singleton_groups, targets))
+    df["Group"] = df["Group"].map(remap).fillna(df["Group"]).astype(int)
     return df
 
 
+def concatenate_groups(df: pd.DataFrame) -> pd.DataFrame:
+    """Join the sequences and collect the names of each group, ordered by group id."""
+    sequences: Dict[int, List[str]] = {}
+    names: Dict[int, List[str]] = {}
+    for gid, seq, name in zip(
+        df["Group"].tolist(), df["Sequence"].tolist(), df["Name"].tolist()
+    ):
+        sequences.setdefault(gid, []).append(seq)
+        names.setdefault(gid, []).append(name)
+    group_ids = sorted(sequences)
+    joined = ["".join(sequences[gid]) for gid in group_ids]
+    return pd.DataFrame(
+        {
+            "Group": np.array(group_ids, dtype=int),
+            "Sequence": joined,
+            "Name": [names[gid] for gid in group_ids],
+            "Length": [len(seq) for seq in joined],
+        }
+    )
+
+
 def replace_cut_sites_and_pad(grouped_df: pd.DataFrame) -> pd.DataFrame:
     df = grouped_df.copy()
-    for idx, row in df.iterrows():
-        group, sequence, name, length = row
-        new_seq = nth_repl(sequence, BsmBI, BbsI, 2)
-        new_seq = nth_repl(new_seq, BsmBI_rev, BbsI_rev, 2)
-        new_seq = nth_repl(new_seq, BsmBI, BspMI, 2)
-        new_seq = nth_repl(new_seq, BsmBI_rev, BspMI_rev, 2)
-        if len(new_seq) < 300:
-            padding = "".join(random.choices(NUCL, k=MIN_LENGTH - len(new_seq)))
-            for cut in (
-                BsmBI, BsaI, BbsI, BspMI,
-                BsmBI_rev, BsaI_rev, BbsI_rev, BspMI_rev,
-            ):
-                padding = padding.replace(cut, "ATCCGATGGTC")
-            new_seq += padding
-        df.at[idx, "Sequence"] = new_seq
-        df.at[idx, "Length"] = len(new_seq)
+    sequences = [
+        replace_nth_multi(seq, BsmBI_SWAPS, BsmBI_SWAP_RE)
+        for seq in df["Sequence"].tolist()
+    ]
+
+    # draw the padding for all short sequences at once and slice it per row
+    pad_lengths = [MIN_LENGTH - len(seq) if len(seq) < 300 else 0 for seq in sequences]
+    rng = np.random.default_rng()
+    nucl = np.frombuffer("".join(NUCL).encode("ascii"), dtype=np.uint8)
+    pool = nucl[rng.integers(len(NUCL), size=sum(pad_lengths))].tobytes().decode("ascii")
+    offset = 0
+    for i, pad_length in enumerate(pad_lengths):
+        if pad_length:
+            padding = pool[offset : offset + pad_length]
+            # re.sub does not rescan its output, and the filler can complete
+            # a new site with its neighbours, so repeat until none are left
+            while CUT_SITE_RE.search(padding):
+                padding = CUT_SITE_RE.sub("ATCCGATGGTC", padding)
+            sequences[i] += padding
+            offset += pad_length
+    df["Sequence"] = sequences
+    df["Length"] = df["Sequence"].str.len()
     return df
 
 
@@ -146,27 +260,29 @@ def pipeline(
 ) -> Path:
     if progress:
         progress(0)
-    df = pd.read_csv(csv_path, sep=";")
+    df = pd.read_csv(csv_path, sep=";", engine="pyarrow", dtype="string[pyarrow]")
     if progress:
         progress(2)
 
-    df = df.apply(lambda x: x.astype(str).str.upper())
-    df_large = df[df["Sequence"].apply(len) >= 400]
+    # a blank Sequence cell is not a fragment; other blank cells stay NA
+    df = df.dropna(subset=["Sequence"])
+    for col in df.columns:
+        df[col] = df[col].str.upper()
+    lengths = df["Sequence"].str.len()
+    df_large = df[lengths >= 400]
     # filter short fragments and reset index so numpy arrays align
-    df = df[df["Sequence"].apply(len) < MAX_LENGTH].reset_index(drop=True)
+    df = df[lengths < MAX_LENGTH].reset_index(drop=True)
 
     # distance matrix + clustering
     fragments = df["Sequence"].to_numpy()
     sim = compute_distance_matrix(fragments, progress)
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
-        affprop = AffinityPropagation(affinity="precomputed", random_state=0)
+        # sim is not needed afterwards, so let AP work on it in place
+        affprop = AffinityPropagation(affinity="precomputed", copy=False, random_state=0)
         affprop.fit(sim)
 
-    clusters = np.empty(len(df), dtype=int)
-    for cid in np.unique(affprop.labels_):
-        clusters[affprop.labels_ == cid] = cid
-    df["Cluster"] = clusters
+    df["Cluster"] = affprop.labels_.astype(int, copy=False)
     if progress:
         progress(90)
 
@@ -174,30 +290,20 @@ def pipeline(
     if aggressive:
         df1 = apply_aggressive_grouping(df1)
 
-    grouped = (
-        df1.groupby("Group").agg({"Sequence": "".join, "Name": list}).reset_index()
-    )
-    grouped["Length"] = grouped["Sequence"].str.len()
+    grouped = concatenate_groups(df1)
 
     # add back large fragments
     max_group = grouped["Group"].max() if not grouped.empty else 0
-    for _, row in df_large.iterrows():
-        name, author, frag = row
-        max_group += 1
-        grouped = pd.concat(
-            [
-                grouped,
-                pd.DataFrame(
-                    {
-                        "Group": [max_group],
-                        "Sequence": [frag],
-                        "Name": [[name]],
-                        "Length": [len(frag)],
-                    }
-                ),
-            ],
-            ignore_index=True,
-        )
+    large_frags = df_large["Sequence"].tolist()
+    large = pd.DataFrame(
+        {
+            "Group": np.arange(max_group + 1, max_group + 1 + len(large_frags)),
+            "Sequence": large_frags,
+            "Name": [[name] for name in df_large["Name"]],
+            "Length": [len(frag) for frag in large_frags],
+        }
+    )
+    grouped = pd.concat([grouped, large], ignore_index=True)
 
     grouped = replace_cut_sites_and_pad(grouped)
     if progress: